@@ -1,5 +1,5 @@
 #This is a programme which creates a preview collage picture from a video grabbing frames at equal intervals
-#Pre-requisites - Python (libraries - cv2, PIL)
+#Pre-requisites - Python (libraries - cv2, PIL), pandas and openpyxl only for --info
 #<msenthilm1023@gmail.com>
 """ 
     USAGE
@@ -17,8 +17,26 @@
 import cv2
 import os
 import time
+import re
+import json
+import shutil
+import hashlib
 import argparse
 from PIL import Image, ImageDraw, ImageFont
+from video_info import read_video_properties, format_video_info, save_to_excel
+
+# Sampled frames with an average luma below this (0-255) are counted as black frames
+BLACK_FRAME_LUMA = 16
+
+# Preview cache settings, bump the version whenever the rendering changes so old entries are not reused
+PREVIEW_CACHE_VERSION = 2
+DEFAULT_CACHE_SIZE_MB = 4096
+STALE_TEMP_SECONDS = 3600  # .tmp files older than this are left over from an interrupted run
+LAST_USED_REFRESH_SECONDS = 24 * 3600  # Last use time of a cache entry is only rewritten when older than this
+CACHE_FILE_PATTERN = re.compile(r"^[0-9a-f]{40}\.(jpg|json)(\.tmp)?$")  # <key>.jpg / <key>.json and their temporary files
+CACHE_RECORD_FIELDS = ('video_info', 'output_size', 'output_mtime_ns', 'last_used')
+OUTPUT_TEMP_PATTERN = re.compile(r"_preview\.jpg\.tmp$")
+PARTIAL_HASH_BYTES = 1024 * 1024  # Bytes hashed from the start and the end of the video when hash_content is set
 
 # Utility function to convert seconds into HH:MM:SS format
 def convert_seconds_to_hms(seconds):
@@ -30,14 +48,16 @@ def convert_seconds_to_hms(seconds):
 def create_video_preview(video_path, output_path, preview_size=(3820, 2384), rows=6, cols=6, border_size=10, shadow_offset=(5, 5), width_to_height_ratio=16/9):
     start_time = time.time()  # Start time for performance measurement
     
-    # Open video file and get properties
+    # Open video file and get properties, the catalog row is built from the same probe so the file is read only once
     cap = cv2.VideoCapture(video_path)
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    duration = frame_count / fps
-    file_size = os.path.getsize(video_path) / (1024 * 1024)  # Convert to MB
+    properties = read_video_properties(cap, video_path)
+    video_info = format_video_info(properties, video_path)
+    frame_count = properties['frame_count']
+    fps = properties['fps']
+    width = properties['width']
+    height = properties['height']
+    duration = properties['duration']
+    file_size = properties['file_size']
 
     # Metadata text
     filename = os.path.basename(video_path)
@@ -85,6 +105,8 @@ def create_video_preview(video_path, output_path, preview_size=(3820, 2384), row
     sample_interval = frame_count // (rows * cols)
 
     frame_idx = 0
+    # Luma of every sampled frame, used for the cheap stats in the metadata row
+    frame_lumas = []
     # Element dimensions for the grid (fixed to 16:9 aspect ratio)
     cell_width = grid_width // cols  # Each element width including padding
     cell_height = grid_height // rows  # Each element height including padding
@@ -98,6 +120,9 @@ def create_video_preview(video_path, output_path, preview_size=(3820, 2384), row
                 print("Failed to retrieve frame at index", frame_idx)
                 continue
 
+            # Average luma of the frame we already decoded, no extra seek or decode needed
+            frame_lumas.append(float(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY).mean()))
+
             # Convert frame from BGR (OpenCV) to RGB (Pillow)
             frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             frame_pil = Image.fromarray(frame_rgb).resize((cell_width - 2 * border_size, cell_height - 2 * border_size))
@@ -136,24 +161,223 @@ def create_video_preview(video_path, output_path, preview_size=(3820, 2384), row
             frame_idx += sample_interval
 
     # Save the final image with high quality (quality set to 100 for the best JPEG quality)
-    preview_image.save(output_path, quality=100)
+    # Written to a temporary file first so an interrupted run never leaves a half written preview behind
+    temp_path = output_path + ".tmp"
+    preview_image.save(temp_path, format="JPEG", quality=100)
+    os.replace(temp_path, output_path)
+
+    cap.release()
+
+    # Add the frame stats to the metadata row, computed from the frames already decoded for the grid
+    if frame_lumas:
+        video_info['avg_luma'] = round(sum(frame_lumas) / len(frame_lumas), 2)
+        video_info['black_frame_ratio'] = round(sum(1 for luma in frame_lumas if luma < BLACK_FRAME_LUMA) / len(frame_lumas), 3)
+    else:
+        video_info['avg_luma'] = None
+        video_info['black_frame_ratio'] = None
     
     end_time = time.time()
     print(f"Preview image saved to {output_path}")
     print(f"Time taken: {end_time - start_time:.2f} seconds")
+    return video_info
+
+# Identity of the source video, size and modification time plus an optional hash of its first and last bytes
+def get_file_identity(video_path, hash_content=False):
+    stat = os.stat(video_path)
+    identity = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if hash_content:
+        content_hash = hashlib.sha1()
+        with open(video_path, 'rb') as f:
+            content_hash.update(f.read(PARTIAL_HASH_BYTES))
+            if stat.st_size > PARTIAL_HASH_BYTES:
+                f.seek(max(PARTIAL_HASH_BYTES, stat.st_size - PARTIAL_HASH_BYTES))
+                content_hash.update(f.read(PARTIAL_HASH_BYTES))
+        identity['content_hash'] = content_hash.hexdigest()
+    return identity
+
+# Cache key made from the source identity and a hash of everything else drawn into the preview or stored in its info row,
+# the filename is included since it is printed on the preview and saved in the row
+def get_preview_cache_key(video_path, rows, cols, preview_size, border_size, hash_content=False):
+    params = {'filename': os.path.basename(video_path), 'rows': rows, 'cols': cols, 'preview_size': list(preview_size), 'border_size': border_size}
+    params_hash = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+    key_data = {'version': PREVIEW_CACHE_VERSION, 'source': get_file_identity(video_path, hash_content), 'params': params_hash}
+    return hashlib.sha1(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+
+# Copy a file so that the destination is either the old file or the complete new one, never a partial copy
+def atomic_copy(source_path, destination_path):
+    temp_path = destination_path + ".tmp"
+    shutil.copyfile(source_path, temp_path)
+    os.replace(temp_path, destination_path)
+
+def write_json_atomic(data, path):
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+# Delete .tmp files matching pattern that were left behind by interrupted runs, returns the size of the ones recent enough to be in use
+def remove_stale_temp_files(directory, pattern):
+    in_use_size = 0
+    for filename in os.listdir(directory):
+        if not filename.endswith(".tmp") or not pattern.search(filename):
+            continue
+        path = os.path.join(directory, filename)
+        stat = os.stat(path)
+        if time.time() - stat.st_mtime > STALE_TEMP_SECONDS:
+            os.remove(path)
+        else:
+            in_use_size += stat.st_size
+    return in_use_size
+
+# Returns the cache record at record_path, or None if it is missing, corrupt or from an older layout
+def read_cache_record(record_path):
+    try:
+        with open(record_path) as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(record, dict) or not all(field in record for field in CACHE_RECORD_FIELDS):
+        return None
+    return record
+
+# Each cache entry is a small <key>.json record (video info, size and mtime of the output it was saved as, last use time)
+# and an optional <key>.jpg copy of the preview. The record alone is enough to skip an unchanged output,
+# the jpg copy is only needed to restore an output that was deleted or changed, and is the first thing evicted
+def load_cached_preview(cache_dir, key, output_path):
+    record_path = os.path.join(cache_dir, f"{key}.json")
+    cached_jpg = os.path.join(cache_dir, f"{key}.jpg")
+    record = read_cache_record(record_path)
+    if record is None:
+        return None
+
+    record_changed = False
+    output_unchanged = False
+    if os.path.exists(output_path):
+        stat = os.stat(output_path)
+        output_unchanged = stat.st_size == record['output_size'] and stat.st_mtime_ns == record['output_mtime_ns']
+    if not output_unchanged:
+        if not os.path.exists(cached_jpg):
+            return None
+        atomic_copy(cached_jpg, output_path)
+        stat = os.stat(output_path)
+        record['output_size'] = stat.st_size
+        record['output_mtime_ns'] = stat.st_mtime_ns
+        record_changed = True
+
+    # Last use is kept in the record rather than in file timestamps, which are coarse or not updated on some network mounts.
+    # It is only rewritten once it is older than LAST_USED_REFRESH_SECONDS, so a re-run over an unchanged library only reads
+    if time.time() - record['last_used'] > LAST_USED_REFRESH_SECONDS:
+        record['last_used'] = time.time()
+        record_changed = True
+    if record_changed:
+        write_json_atomic(record, record_path)
+    return record
+
+def store_cached_preview(cache_dir, key, output_path, video_info):
+    atomic_copy(output_path, os.path.join(cache_dir, f"{key}.jpg"))
+    stat = os.stat(output_path)
+    record = {'video_info': video_info, 'output_size': stat.st_size, 'output_mtime_ns': stat.st_mtime_ns, 'last_used': time.time()}
+    write_json_atomic(record, os.path.join(cache_dir, f"{key}.json"))
+    return record
+
+# Delete the least recently used jpg copies until the cache fits in cache_size_mb,
+# records are only removed if the cache is still over budget once every jpg copy is gone.
+# Only files named like cache entries are counted or removed, cache_dir may hold other files.
+# last_used holds the times already known from this run, records are only read for the other keys
+def evict_preview_cache(cache_dir, cache_size_mb, last_used=None):
+    last_used = dict(last_used or {})
+    total_size = remove_stale_temp_files(cache_dir, CACHE_FILE_PATTERN)
+    file_sizes = {}
+    for filename in os.listdir(cache_dir):
+        if filename.endswith(".tmp") or not CACHE_FILE_PATTERN.search(filename):
+            continue
+        file_sizes[filename] = os.path.getsize(os.path.join(cache_dir, filename))
+        total_size += file_sizes[filename]
+
+    budget = cache_size_mb * 1024 * 1024
+    if total_size <= budget:
+        return
+
+    for filename in file_sizes:
+        key, ext = os.path.splitext(filename)
+        if ext == ".json" and key not in last_used:
+            record = read_cache_record(os.path.join(cache_dir, filename))
+            last_used[key] = record['last_used'] if record is not None else 0
+
+    for ext in (".jpg", ".json"):
+        # jpg copies without a record were never completed and corrupt records are useless, so they go first
+        keys = sorted((os.path.splitext(f)[0] for f in file_sizes if f.endswith(ext)), key=lambda key: (last_used.get(key, 0), key))
+        for key in keys:
+            if total_size <= budget:
+                return
+            os.remove(os.path.join(cache_dir, f"{key}{ext}"))
+            total_size -= file_sizes[f"{key}{ext}"]
+            print(f"Evicted cached preview {key}{ext}")
+
+# Type for argparse, rejects sizes that would empty the cache on every run
+def positive_int(value):
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+    return number
+
+# Checks the cache settings and creates the cache directory, returns its path
+def prepare_preview_cache(output_directory, cache_dir=None, cache_size_mb=DEFAULT_CACHE_SIZE_MB):
+    if cache_size_mb <= 0:
+        raise ValueError(f"cache_size_mb must be positive, got {cache_size_mb}")
+    if cache_dir is None:
+        cache_dir = os.path.join(output_directory, ".preview_cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+# Create the preview of one video, skipping it if the cache in cache_dir has it for the same file and parameters.
+# The last use time of the cache entry is added to last_used, to be passed on to evict_preview_cache
+def generate_preview(video_path, output_path, preview_size=(3820, 2384), rows=6, cols=6, border_size=10, cache_dir=None, hash_content=False, last_used=None):
+    filename = os.path.basename(video_path)
+    if cache_dir is None:
+        video_info = create_video_preview(video_path, output_path, preview_size=preview_size, rows=rows, cols=cols, border_size=border_size)
+        print(f"Preview for {filename} saved as {output_path}")
+        return video_info
+
+    key = get_preview_cache_key(video_path, rows, cols, preview_size, border_size, hash_content)
+    record = load_cached_preview(cache_dir, key, output_path)
+    if record is not None:
+        print(f"Preview for {filename} is unchanged, skipped")
+    else:
+        video_info = create_video_preview(video_path, output_path, preview_size=preview_size, rows=rows, cols=cols, border_size=border_size)
+        record = store_cached_preview(cache_dir, key, output_path, video_info)
+        print(f"Preview for {filename} saved as {output_path}")
+    if last_used is not None:
+        last_used[key] = record['last_used']
+    return record['video_info']
 
 # Function to process all MP4 files in the directory
-def generate_previews_for_directory(input_directory, output_directory):
+# If with_info is set, the metadata of every video is also saved to video_info.xlsx in the output directory
+# Unless use_cache is False, videos whose file and layout parameters are unchanged since the last run are not rendered again,
+# the cache lives in cache_dir (default: '.preview_cache' in the output directory) and is kept under cache_size_mb
+def generate_previews_for_directory(input_directory, output_directory, with_info=False, preview_size=(3820, 2384), rows=6, cols=6, border_size=10,
+                                    use_cache=True, cache_dir=None, cache_size_mb=DEFAULT_CACHE_SIZE_MB, hash_content=False):
     # Check if output directory exists, if not create it
     if not os.path.exists(output_directory):
         os.makedirs(output_directory)
+    # Only our own temporary previews, the output directory may hold other files
+    remove_stale_temp_files(output_directory, OUTPUT_TEMP_PATTERN)
+    cache_dir = prepare_preview_cache(output_directory, cache_dir, cache_size_mb) if use_cache else None
     
+    video_info_list = []
+    last_used = {}
     for filename in os.listdir(input_directory):
         if filename.endswith(".mp4"):
             video_path = os.path.join(input_directory, filename)
             output_path = os.path.join(output_directory, f"{os.path.splitext(filename)[0]}_preview.jpg")
-            create_video_preview(video_path, output_path)
-            print(f"Preview for {filename} saved as {output_path}")
+            video_info = generate_preview(video_path, output_path, preview_size=preview_size, rows=rows, cols=cols, border_size=border_size,
+                                          cache_dir=cache_dir, hash_content=hash_content, last_used=last_used)
+            video_info_list.append(video_info)
+
+    if use_cache:
+        evict_preview_cache(cache_dir, cache_size_mb, last_used)
+    if with_info:
+        save_to_excel(video_info_list, output_directory)
 
 # Command-line interface using argparse
 def main():
@@ -163,6 +387,11 @@ def main():
     # Arguments for file path, output directory, number of parts, and file size limits in MB
     parser.add_argument('input', type=str, nargs='?', default=os.getcwd(), help="Input video file or directory (default: current working directory).")
     parser.add_argument('output', type=str, nargs='?', default=os.path.join(os.getcwd(), "screencap"), help="Directory to save the split parts (default: 'split_videos' in current directory).")
+    parser.add_argument('--info', action='store_true', help="Also save video info (with average luma and black frame ratio) to video_info.xlsx in the output directory, probing each file only once.")
+    parser.add_argument('--no_cache', action='store_true', help="Render every preview again instead of skipping videos that are unchanged since the last run.")
+    parser.add_argument('--cache_dir', type=str, default=None, help="Directory for the preview cache (default: '.preview_cache' in the output directory).")
+    parser.add_argument('--cache_size', type=positive_int, default=DEFAULT_CACHE_SIZE_MB, help=f"Maximum size of the preview cache in MB, least recently used preview copies are evicted first (default: {DEFAULT_CACHE_SIZE_MB} MB).")
+    parser.add_argument('--hash_content', action='store_true', help="Also hash the first and last MB of each video to detect changes that keep the size and modification time.")
     
     # Parse the command-line arguments
     args = parser.parse_args()
@@ -170,12 +399,22 @@ def main():
     # Check if input is a directory or file
     if os.path.isdir(args.input):
         print(f"Getting screenshot of all MP4 files in directory: {args.input}")
-        generate_previews_for_directory(args.input, args.output)
+        generate_previews_for_directory(args.input, args.output, with_info=args.info, use_cache=not args.no_cache, cache_dir=args.cache_dir,
+                                        cache_size_mb=args.cache_size, hash_content=args.hash_content)
     elif os.path.isfile(args.input) and args.input.endswith('.mp4'):
         print(f"Getting screenshot of single video: {args.input}")
         output_name = os.path.join(os.getcwd(), "screencap")
         output_name = os.path.join(output_name, f"{os.path.splitext(os.path.basename(args.input))[0]}_preview.jpg")
-        create_video_preview(args.input, output_name)
+        output_directory = os.path.dirname(output_name)
+        os.makedirs(output_directory, exist_ok=True)
+        remove_stale_temp_files(output_directory, OUTPUT_TEMP_PATTERN)
+        cache_dir = None if args.no_cache else prepare_preview_cache(output_directory, args.cache_dir, args.cache_size)
+        last_used = {}
+        video_info = generate_preview(args.input, output_name, cache_dir=cache_dir, hash_content=args.hash_content, last_used=last_used)
+        if cache_dir is not None:
+            evict_preview_cache(cache_dir, args.cache_size, last_used)
+        if args.info:
+            save_to_excel([video_info], os.path.dirname(output_name))
     else:
         print("Invalid input. Please provide a valid MP4 file or directory.")
 
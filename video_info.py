@@ -1,7 +1,6 @@
 import cv2
 import os
 import argparse
-import pandas as pd
 from datetime import timedelta
 
 # Utility function to convert seconds into HH:MM:SS format
@@ -10,6 +9,15 @@ def convert_seconds_to_hms(seconds):
 
 def get_video_info(video_path):
     cap = cv2.VideoCapture(video_path)
+    video_info = read_video_info(cap, video_path)
+    cap.release()
+    return video_info
+
+def read_video_info(cap, video_path):
+    return format_video_info(read_video_properties(cap, video_path), video_path)
+
+# Reads the raw properties from an already opened capture, so callers that also decode frames don't open the file twice
+def read_video_properties(cap, video_path):
     fps = cap.get(cv2.CAP_PROP_FPS)
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
@@ -22,15 +30,30 @@ def get_video_info(video_path):
     codec = chr((codec & 0xFF)) + chr((codec >> 8) & 0xFF) + chr((codec >> 16) & 0xFF) + chr((codec >> 24) & 0xFF)
     
     return {
-        'filename': os.path.basename(video_path),
-        'duration': convert_seconds_to_hms(duration),
-        'file_size': f"{file_size:.2f} MB",
         'fps': fps,
-        'resolution': f"{width}x{height}",
+        'width': width,
+        'height': height,
+        'frame_count': frame_count,
+        'duration': duration,
+        'file_size': file_size,
         'codec': codec
     }
 
+# Builds the metadata row saved to the excel file from the raw properties
+def format_video_info(properties, video_path):
+    return {
+        'filename': os.path.basename(video_path),
+        'duration': convert_seconds_to_hms(properties['duration']),
+        'file_size': f"{properties['file_size']:.2f} MB",
+        'fps': properties['fps'],
+        'resolution': f"{properties['width']}x{properties['height']}",
+        'codec': properties['codec']
+    }
+
 def save_to_excel(video_info_list, output_path):
+    # Imported here so read_video_info can be used without pandas installed
+    import pandas as pd
+
     # Creating a DataFrame from the list of video info
     df = pd.DataFrame(video_info_list)
 